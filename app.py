@@ -1,30 +1,38 @@
 import streamlit as st
-import json
+import asyncio
+import hashlib
+import orjson
+import re
+import string
 import time
-import os
 import uuid
+import zipfile
 import requests
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
 import nltk
+import trafilatura
+import diskcache
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
+from tenacity import AsyncRetrying, retry_if_exception_type, wait_random_exponential, stop_after_attempt
 
 # Load environment variables
 load_dotenv()
 
-# Setup NLTK
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-
 # Azure OpenAI Client
-client = AzureOpenAI(
-    azure_endpoint= st.secrets["azure_api"]["AZURE_OPENAI_ENDPOINT"],
-    api_key= st.secrets["azure_api"]["AZURE_OPENAI_API_KEY"],
-    api_version="2024-02-01"
-)
+AZURE_OPENAI_CONFIG = {
+    "azure_endpoint": st.secrets["azure_api"]["AZURE_OPENAI_ENDPOINT"],
+    "api_key": st.secrets["azure_api"]["AZURE_OPENAI_API_KEY"],
+    "api_version": "2024-10-21"
+}
 
 AZURE_TTS_URL = st.secrets["azure"]["AZURE_TTS_URL"]
 AZURE_API_KEY = st.secrets["azure"]["AZURE_API_KEY"]
@@ -36,6 +44,72 @@ AWS_BUCKET = st.secrets["aws"]["AWS_BUCKET"]
 S3_PREFIX = st.secrets["aws"]["S3_PREFIX"]
 CDN_BASE = st.secrets["aws"]["CDN_BASE"]
 
+# Parallel TTS synthesis + S3 upload workers
+TTS_WORKERS = 8
+# On Azure the deployment in AZURE_TTS_URL (/deployments/<name>/audio/speech) decides which model runs,
+# not the request body. Use it as the model name so the TTS cache key names the model that produced the
+# audio. tts-1 is the low-latency model (tts-1-hd is slower and twice the price); to switch, point
+# AZURE_TTS_URL at a tts-1 deployment.
+_tts_deployment = re.search(r"/deployments/([^/?]+)", AZURE_TTS_URL)
+TTS_MODEL = _tts_deployment.group(1) if _tts_deployment else "tts-1"
+
+# Multipart upload for larger MP3s; the pool is sized so parallel uploads don't starve each other
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=1 * 1024 * 1024,
+    multipart_chunksize=5 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True
+)
+S3_CLIENT_CONFIG = Config(tcp_keepalive=True, max_pool_connections=50)
+
+# === Shared Resources (built once per server process, reused across reruns) ===
+@st.cache_resource(show_spinner=False)
+def get_sentiment_analyzer():
+    # VADER is a regex tokenizer + lexicon lookup; far cheaper than TextBlob's tokenize/POS-tag pipeline
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    try:
+        nltk.data.find('sentiment/vader_lexicon.zip')
+    except LookupError:
+        nltk.download('vader_lexicon')
+    return SentimentIntensityAnalyzer()
+
+@st.cache_resource
+def get_openai_client():
+    # The async client is not cached: its connection pool is bound to the event loop of each asyncio.run
+    return AzureOpenAI(**AZURE_OPENAI_CONFIG)
+
+@st.cache_resource
+def get_s3_client():
+    return boto3.session.Session().client(
+        "s3",
+        aws_access_key_id=AWS_ACCESS_KEY,
+        aws_secret_access_key=AWS_SECRET_KEY,
+        region_name=AWS_REGION,
+        config=S3_CLIENT_CONFIG,
+    )
+
+@st.cache_resource
+def get_tts_session():
+    # Keep-alive connections to the TTS endpoint, one per parallel worker
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=TTS_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_resource
+def get_llm_cache():
+    # Persistent exact-match cache for GPT stories and TTS CDN URLs, keyed by content hash
+    return diskcache.Cache("./.llm_cache")
+
+client = get_openai_client()
+LLM_CACHE = get_llm_cache()
+
+# Pretty-printed UTF-8 JSON for downloads (orjson never ASCII-escapes, so Devanagari stays readable)
+JSON_DUMP_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+# orjson rejects a leading BOM (e.g. files saved from Windows Notepad); strip it before parsing uploads
+UTF8_BOM = b"\xef\xbb\xbf"
+
 voice_options = {
     "1": "alloy",
     "2": "echo",
@@ -46,29 +120,67 @@ voice_options = {
 }
 
 # === Utility Functions ===
-def extract_article(url):
-    import newspaper
-    article = newspaper.Article(url)
-    article.download()
-    article.parse()
+# Pure pipeline steps are memoized across reruns (e.g. flipping the persona doesn't re-run them).
+# Long article strings are keyed by a blake2b digest instead of Streamlit's default hashing.
+PIPELINE_CACHE_TTL = 3600
+PIPELINE_HASH_FUNCS = {str: lambda text: hashlib.blake2b(text.encode("utf-8")).digest()}
 
-    try:
-        article.nlp()
-    except:
-        pass
+def article_fingerprint(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def _cache_key(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def _parse_article(html):
+    # Single parse for text and metadata; newspaper3k's full lxml pipeline + nlp() was the slow part
+    doc = trafilatura.bare_extraction(html, include_comments=False, favor_precision=True, as_dict=True) or {}
+
+    # No text means nothing to write a story about; a placeholder here would share one story cache key
+    text = doc.get("text")
+    if not text or not text.strip():
+        raise ValueError("No article content could be extracted")
 
     # Fallbacks for missing fields
-    title = article.title if article.title else "Untitled Article"
-    text = article.text if article.text else "No article content available."
-    summary = article.summary if article.summary else text[:300]
+    title = doc.get("title") or "Untitled Article"
+    summary = doc.get("description") or text[:300]
 
     # Final strip to ensure clean outputs
     return title.strip(), summary.strip(), text.strip()
 
+async def _fetch_article(http, url):
+    response = await http.get(url)
+    response.raise_for_status()
+    # Parsing is CPU-bound; keep it off the event loop so other downloads keep flowing
+    loop = asyncio.get_running_loop()
+    # Raw bytes: trafilatura sniffs the encoding (incl. <meta charset>) when the header has none
+    return await loop.run_in_executor(None, _parse_article, response.content)
+
+async def _extract_articles(urls):
+    # One HTTP/2 client per run: same-host URLs share a multiplexed TLS connection
+    async with httpx.AsyncClient(http2=True, timeout=10, follow_redirects=True) as http:
+        # One bad URL (404, timeout) must not sink the rest of a batch
+        return await asyncio.gather(*(_fetch_article(http, url) for url in urls), return_exceptions=True)
+
+def extract_articles(urls):
+    # Returns ([(url, title, summary, text)], [(url, reason)]) so callers can report failed URLs
+    articles, failed = [], []
+    for url, result in zip(urls, asyncio.run(_extract_articles(urls))):
+        if isinstance(result, Exception):
+            failed.append((url, str(result) or type(result).__name__))
+        else:
+            articles.append((url, *result))
+    return articles, failed
 
-def get_sentiment(text):
-    from textblob import TextBlob
-    polarity = TextBlob(text).sentiment.polarity
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, show_spinner=False, hash_funcs=PIPELINE_HASH_FUNCS)
+def extract_article(url):
+    result = asyncio.run(_extract_articles([url]))[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _score_sentiment(text):
+    polarity = get_sentiment_analyzer().polarity_scores(text)["compound"]
     if polarity > 0.2:
         return "positive"
     elif polarity < -0.2:
@@ -76,92 +188,125 @@ def get_sentiment(text):
     else:
         return "neutral"
 
-def detect_category_and_subcategory(text):
-    prompt = f"""
-You are an expert news analyst.
-
-Analyze the following news article and return:
-
-1. category
-2. subcategory
-3. emotion
-
-Article:
-\"\"\"{text[:3000]}\"\"\"
-
-Return as JSON:
-{{
-  "category": "...",
-  "subcategory": "...",
-  "emotion": "..."
-}}
-"""
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "Classify article into category, subcategory, and emotion."},
-            {"role": "user", "content": prompt.strip()}
-        ]
-    )
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, show_spinner=False, hash_funcs=PIPELINE_HASH_FUNCS)
+def get_sentiment(text):
+    return _score_sentiment(text)
+
+STORY_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "web_story",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "category": {"type": "string"},
+                "subcategory": {"type": "string"},
+                "emotion": {"type": "string"},
+                "slides": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "title": {"type": "string"},
+                            "prompt": {"type": "string"},
+                            "image_prompt": {"type": "string"},
+                            "script": {"type": "string"}
+                        },
+                        "required": ["title", "prompt", "image_prompt", "script"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["category", "subcategory", "emotion", "slides"],
+            "additionalProperties": False
+        }
+    }
+}
 
-    content = response.choices[0].message.content.strip()
-    content = content.strip("```json").strip("```").strip()
+GPT_TRANSIENT_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
 
-    try:
-        return json.loads(content)
-    except:
-        return {
-            "category": "Unknown",
-            "subcategory": "General",
-            "emotion": "Neutral"
-        }
+STORY_KEYS = {"category", "subcategory", "emotion", "slides"}
 
-def title_script_generator(category, subcategory, emotion, article_text, character_sketch=None):
-    if not character_sketch:
-        character_sketch = "Polaris is a sincere and articulate Hindi-English news anchor..."
+DEFAULT_CHARACTER_SKETCH = "Polaris is a sincere and articulate Hindi-English news anchor..."
 
-    system_prompt = """
-You are a digital content editor.
+# Submitted Azure Batch API jobs (complete within the 24h window), persisted in LLM_CACHE by batch id
+BATCH_JOBS_KEY = "batch-jobs"
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
 
-Create a structured 5-slide web story from the article below. Each slide must contain:
-- A short English title (for the slide)
-- A prompt: a clear instruction telling another GPT model what narration to write (don't write the narration here)
+# Static prompt prefix, stripped once at import; the character sketch is appended per request
+STORY_SYSTEM_PROMPT = """
+You are an expert news analyst and digital content editor writing for Polaris, a Hindi-English news anchor.
 
-Format:
-{
-  "slides": [
-    { "title": "...", "prompt": "..." },
-    ...
-  ]
-}
-"""
-    user_prompt = f"""
-Category: {category}
-Subcategory: {subcategory}
-Emotion: {emotion}
-
-Article:
-\"\"\"{article_text[:3000]}\"\"\"
-"""
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": system_prompt.strip()},
-            {"role": "user", "content": user_prompt.strip()}
-        ]
-    )
+For the article provided:
+1. Classify it into a category, subcategory, and emotion.
+2. Create a structured 5-slide web story. Each slide must contain:
+- title: a short English title (for the slide)
+- prompt: the editorial instruction for what this slide narrates
+- image_prompt: a modern vector-style visual description for the slide
+- script: a 3–4 line Hindi-English narration in the voice of Polaris that follows the prompt
+
+Tone: Warm, simple, and clear. Avoid self-introduction.
+
+Character sketch:
+""".strip()
+
+# Strips a stray ```json ... ``` fence if a model ever wraps its JSON in one
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.S)
+
+def _parse_json(content):
+    return orjson.loads(_FENCE_RE.sub("", content.strip()))
+
+@lru_cache(maxsize=32)
+def _story_system_prompt(character_sketch):
+    # Persona + tone live only in the system message; keeping it byte-identical across
+    # requests lets Azure reuse the cached prompt prefix.
+    return f"{STORY_SYSTEM_PROMPT}\n{character_sketch.strip()}"
 
-    content = response.choices[0].message.content.strip()
-    content = content.strip("```json").strip("```").strip()
+def _story_request_body(article_text, character_sketch):
+    # Category, emotion, slide outlines and narrations all come back from one structured call,
+    # so the article is sent (and billed) once per story.
+    return {
+        "model": "gpt-4o",
+        "messages": [
+            {"role": "system", "content": _story_system_prompt(character_sketch)},
+            {"role": "user", "content": f"Article:\n\"\"\"{article_text[:3000]}\"\"\""}
+        ],
+        "response_format": STORY_RESPONSE_FORMAT
+    }
 
+async def _generate_story(article_text, character_sketch):
+    # tenacity owns retries (SDK retries off so they don't multiply), and only for transient
+    # failures; 400s (content filter, schema) and auth errors fail immediately
+    async with AsyncAzureOpenAI(**AZURE_OPENAI_CONFIG, max_retries=0) as aclient:
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception_type(GPT_TRANSIENT_ERRORS),
+            wait=wait_random_exponential(max=20),
+            stop=stop_after_attempt(3),
+            reraise=True
+        ):
+            with attempt:
+                response = await aclient.chat.completions.create(
+                    **_story_request_body(article_text, character_sketch)
+                )
+    return response.choices[0].message.content
+
+def _parse_story(content):
+    # Raise rather than fall back to an empty story, so no cache layer keeps a failed generation
     try:
-        slides_raw = json.loads(content)["slides"]
-    except:
-        return {"category": category, "subcategory": subcategory, "emotion": emotion, "slides": []}
+        story = _parse_json(content)
+    except Exception as e:
+        raise ValueError("Story generation returned malformed JSON (refused or truncated response)") from e
+    if not isinstance(story, dict) or not STORY_KEYS <= story.keys() or not story["slides"]:
+        raise ValueError("Story generation returned an incomplete story")
+    return story
+
+def _build_story(article_text, content):
+    story = _parse_story(content)
 
     if not article_text:
         article_text = "This article content could not be extracted properly."
-    
+
     headline = article_text.split("\n")[0].strip().replace('"', '')
     slide1_script = f"Namaskar doston, main hoon Polaris. Aaj ki badi khabar: {headline}"
 
@@ -171,37 +316,191 @@ Article:
         "image_prompt": f"Vector-style illustration of Polaris presenting news: {headline}",
         "script": slide1_script
     }]
+    slides.extend(story["slides"][:5])
 
-    for slide in slides_raw:
-        narration_prompt = f"""
-Write a 3–4 line Hindi-English narration in the voice of Polaris.
+    return {
+        "category": story["category"],
+        "subcategory": story["subcategory"],
+        "emotion": story["emotion"],
+        "slides": slides
+    }
 
-Instruction: {slide['prompt']}
-Tone: Warm, simple, and clear. Avoid self-introduction.
+def _story_cache_key(article_text, character_sketch):
+    body = _story_request_body(article_text, character_sketch)
+    return _cache_key("story", orjson.dumps(body, option=orjson.OPT_SORT_KEYS).decode())
 
-Character sketch:
-{character_sketch}
-"""
-        narration_response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You write news narration in Hindi-English mix."},
-                {"role": "user", "content": narration_prompt.strip()}
-            ]
-        )
-        narration = narration_response.choices[0].message.content.strip()
-        slides.append({
-            "title": slide['title'],
-            "prompt": slide['prompt'],
-            "image_prompt": f"Modern vector-style visual for: {slide['title']}",
-            "script": narration
+def _cache_story(cache_key, content):
+    # Only well-formed responses are worth replaying
+    try:
+        _parse_story(content)
+    except ValueError:
+        return
+    LLM_CACHE.set(cache_key, content)
+
+async def generate_story(article_text, character_sketch=None):
+    if not article_text.strip():
+        raise ValueError("No article content to generate a story from")
+    character_sketch = character_sketch or DEFAULT_CHARACTER_SKETCH
+    cache_key = _story_cache_key(article_text, character_sketch)
+
+    content = LLM_CACHE.get(cache_key)
+    if content is None:
+        content = await _generate_story(article_text, character_sketch)
+        _cache_story(cache_key, content)
+
+    return _build_story(article_text, content)
+
+async def _analyze_article(summary, full_text):
+    # Sentiment is CPU-bound, so it runs in a worker thread while the GPT call waits on the network.
+    # The worker has no ScriptRunContext, so it gets the undecorated scorer; analyze_article caches the pair.
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        loop.run_in_executor(None, _score_sentiment, summary or full_text),
+        generate_story(full_text)
+    )
+
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, show_spinner=False, hash_funcs=PIPELINE_HASH_FUNCS)
+def analyze_article(summary, full_text):
+    # Build (and on a cold start, download) the VADER analyzer here on the script thread,
+    # so the executor worker only ever reads the cached resource
+    get_sentiment_analyzer()
+    sentiment, output = asyncio.run(_analyze_article(summary, full_text))
+    return sentiment, output
+
+def _batch_row_error(row):
+    response = row.get("response") or {}
+    error = row.get("error") or (response.get("body") or {}).get("error") or {}
+    return error.get("message") or f"HTTP {response.get('status_code')}"
+
+def submit_story_batch(articles, persona, character_sketch=None):
+    # Azure Batch API: half-price, separate rate-limit pool, results within 24h.
+    # The job is persisted as soon as the batch exists so it can be collected from any later rerun.
+    character_sketch = character_sketch or DEFAULT_CHARACTER_SKETCH
+    job = {
+        "persona": persona,
+        "articles": articles,
+        "cache_keys": [_story_cache_key(text, character_sketch) for _, _, _, text in articles],
+        "batch_id": None
+    }
+
+    # Only cache misses are sent to the batch
+    lines = [
+        orjson.dumps({
+            "custom_id": f"story-{idx}",
+            "method": "POST",
+            "url": "/chat/completions",
+            "body": _story_request_body(text, character_sketch)
         })
+        for idx, ((_, _, _, text), cache_key) in enumerate(zip(articles, job["cache_keys"]))
+        if cache_key not in LLM_CACHE
+    ]
+    if not lines:
+        return job
+
+    batch_file = client.files.create(
+        file=("stories.jsonl", BytesIO(b"\n".join(lines))),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/chat/completions",
+        completion_window="24h"
+    )
+    job["batch_id"] = batch.id
+    with LLM_CACHE.transact():
+        LLM_CACHE.set(BATCH_JOBS_KEY, {**LLM_CACHE.get(BATCH_JOBS_KEY, {}), batch.id: job})
+    return job
+
+def get_pending_batches():
+    return LLM_CACHE.get(BATCH_JOBS_KEY, {})
+
+def collect_story_batch(job):
+    # Returns (status, results, failed); results is None while the batch is still running.
+    # results: [(url, title, summary, full_text, story)], failed: [(url, reason)]
+    errors = {}
+    status = "completed"
+    batch_reason = None
+    if job["batch_id"]:
+        batch = client.batches.retrieve(job["batch_id"])
+        status = batch.status
+        if status not in BATCH_TERMINAL_STATUSES:
+            return status, None, None
+
+        # Whole-batch failures (input validation, quota) carry their reason here, usually with no files
+        if batch.errors and batch.errors.data:
+            batch_reason = "; ".join(error.message for error in batch.errors.data if error.message)
+
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).content.splitlines():
+                if not line.strip():
+                    continue
+                row = orjson.loads(line)
+                idx = int(row["custom_id"].removeprefix("story-"))
+                response = row.get("response") or {}
+                if response.get("status_code") == 200:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    try:
+                        _parse_story(content)
+                    except ValueError as e:
+                        errors[idx] = str(e)
+                        continue
+                    _cache_story(job["cache_keys"][idx], content)
+                else:
+                    errors[idx] = _batch_row_error(row)
+        with LLM_CACHE.transact():
+            jobs = LLM_CACHE.get(BATCH_JOBS_KEY, {})
+            jobs.pop(job["batch_id"], None)
+            LLM_CACHE.set(BATCH_JOBS_KEY, jobs)
+
+    results, failed = [], []
+    for idx, ((url, title, summary, full_text), cache_key) in enumerate(zip(job["articles"], job["cache_keys"])):
+        content = LLM_CACHE.get(cache_key)
+        if content is None:
+            failed.append((url, errors.get(idx) or batch_reason or f"no result (batch {status})"))
+        else:
+            results.append((url, title, summary, full_text, _build_story(full_text, content)))
+    return status, results, failed
+
+def build_story_bundle(results, persona, timestamp):
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        for idx, (_, title, summary, full_text, output) in enumerate(results, start=1):
+            sentiment = get_sentiment(summary or full_text)
+            structured_output = build_structured_output(title, summary, sentiment, persona, output)
+            zf.writestr(
+                f"structured_slides_{timestamp}_{idx}.json",
+                orjson.dumps(structured_output, option=JSON_DUMP_OPTIONS)
+            )
+    return archive.getvalue()
+
+def build_structured_output(title, summary, sentiment, persona, output):
+    category, subcategory, emotion = output["category"], output["subcategory"], output["emotion"]
+
+    final_output = {
+        "title": title,
+        "summary": summary,
+        "sentiment": sentiment,
+        "emotion": emotion,
+        "category": category,
+        "subcategory": subcategory,
+        "persona": persona,
+        "slides": output.get("slides", []),
+        "storytitle": title.strip()  # ✅ storytitle added here
+    }
 
+    # ✅ Include all metadata and storytitle in the final output JSON
     return {
+        **restructure_slide_output(final_output),
+        "storytitle": title.strip(),
+        "title": title.strip(),
+        "summary": summary,
+        "sentiment": sentiment,
+        "emotion": emotion,
         "category": category,
         "subcategory": subcategory,
-        "emotion": emotion,
-        "slides": slides
+        "persona": persona
     }
 
 def restructure_slide_output(final_output):
@@ -213,59 +512,113 @@ def restructure_slide_output(final_output):
     return structured
 
 def synthesize_and_upload(paragraphs, voice):
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=AWS_ACCESS_KEY,
-        aws_secret_access_key=AWS_SECRET_KEY,
-        region_name=AWS_REGION,
-    )
-
-    result = {}
-    os.makedirs("temp", exist_ok=True)
+    s3 = get_s3_client()
+    tts_session = get_tts_session()
 
-    index = 2
-    for text in paragraphs.values():
-        st.write(f"🛠️ Processing: slide{index}")
+    def process_one(index, text):
+        # Identical paragraph + voice was already synthesized and uploaded; reuse its CDN URL
+        cache_key = _cache_key("tts", TTS_MODEL, voice, text)
+        cdn_url = LLM_CACHE.get(cache_key)
+        if cdn_url is not None:
+            return index, cdn_url
 
-        response = requests.post(
+        response = tts_session.post(
             AZURE_TTS_URL,
             headers={
                 "Content-Type": "application/json",
                 "api-key": AZURE_API_KEY
             },
             json={
-                "model": "tts-1-hd",
+                "model": TTS_MODEL,
                 "input": text,
                 "voice": voice
             }
         )
         response.raise_for_status()
 
-        filename = f"tts_{uuid.uuid4().hex}.mp3"
-        local_path = os.path.join("temp", filename)
-
-        with open(local_path, "wb") as f:
-            f.write(response.content)
-
-        s3_key = f"{S3_PREFIX}{filename}"
-        s3.upload_file(local_path, AWS_BUCKET, s3_key)
+        s3_key = f"{S3_PREFIX}tts_{uuid.uuid4().hex}.mp3"
+        s3.upload_fileobj(
+            BytesIO(response.content),
+            AWS_BUCKET,
+            s3_key,
+            # Audio keys are unique per synthesis, so the CDN can cache them indefinitely
+            ExtraArgs={"ContentType": "audio/mpeg", "CacheControl": "public, max-age=31536000"},
+            Config=S3_TRANSFER_CONFIG
+        )
         cdn_url = f"{CDN_BASE}{s3_key}"
+        LLM_CACHE.set(cache_key, cdn_url)
+        return index, cdn_url
+
+    # TTS + upload per slide is network-bound and independent, so overlap them.
+    # The boto3 client and TTS session are shared by all workers.
+    texts = dict(enumerate(paragraphs.values(), start=2))
+    audio_urls = {}
+    with ThreadPoolExecutor(max_workers=TTS_WORKERS) as executor:
+        futures = [executor.submit(process_one, index, text) for index, text in texts.items()]
+        for future in as_completed(futures):
+            index, cdn_url = future.result()
+            audio_urls[index] = cdn_url
+            st.write(f"🛠️ Processed: slide{index}")
 
-        slide_key = f"slide{index}"
-        paragraph_key = f"s{index}paragraph1"
-        audio_key = f"audio_url{index}"
-
-        result[slide_key] = {
-            paragraph_key: text,
-            audio_key: cdn_url,
+    result = {}
+    for index, text in texts.items():
+        result[f"slide{index}"] = {
+            f"s{index}paragraph1": text,
+            f"audio_url{index}": audio_urls[index],
             "voice": voice
         }
 
-        index += 1
-        os.remove(local_path)
-
     return result
 
+# === AMP Templates ===
+# AMP slide markup, parsed once; pages get a deterministic per-slide id so they don't collide
+_SLIDE_TMPL = string.Template("""
+        <amp-story-page id="$page_id" auto-advance-after="page-$page_id-background-audio" class="i-amphtml-layout-container" i-amphtml-layout="container">
+            <amp-story-animation layout="nodisplay" trigger="visibility" class="i-amphtml-layout-nodisplay" hidden="hidden" i-amphtml-layout="nodisplay">
+                <script type="application/json">[{"selector":"#anim-1a95e072-cada-435a-afea-082ddd65ff10","keyframes":{"opacity":[0,1]},"delay":0,"duration":600,"easing":"cubic-bezier(0.2, 0.6, 0.0, 1)","fill":"both"}]</script>
+            </amp-story-animation>
+            <amp-story-animation layout="nodisplay" trigger="visibility" class="i-amphtml-layout-nodisplay" hidden="hidden" i-amphtml-layout="nodisplay">
+                <script type="application/json">[{"selector":"#anim-a938fe3f-03cf-47c5-9a84-da919c4f870b","keyframes":{"transform":["translate3d(-115.2381%, 0px, 0)","translate3d(0px, 0px, 0)"]},"delay":0,"duration":600,"easing":"cubic-bezier(0.2, 0.6, 0.0, 1)","fill":"both"}]</script>
+            </amp-story-animation>
+            <amp-story-animation layout="nodisplay" trigger="visibility" class="i-amphtml-layout-nodisplay" hidden="hidden" i-amphtml-layout="nodisplay">
+                <script type="application/json">[{"selector":"#anim-f7c5981e-ac77-48d5-9b40-7a987a3e2ab0","keyframes":{"opacity":[0,1]},"delay":0,"duration":600,"easing":"cubic-bezier(0.2, 0.6, 0.0, 1)","fill":"both"}]</script>
+            </amp-story-animation>
+            <amp-story-animation layout="nodisplay" trigger="visibility" class="i-amphtml-layout-nodisplay" hidden="hidden" i-amphtml-layout="nodisplay">
+                <script type="application/json">[{"selector":"#anim-0c1e94dd-ab91-415c-9372-0aa2e7e61630","keyframes":{"transform":["translate3d(-115.55555%, 0px, 0)","translate3d(0px, 0px, 0)"]},"delay":0,"duration":600,"easing":"cubic-bezier(0.2, 0.6, 0.0, 1)","fill":"both"}]</script>
+            </amp-story-animation>
+            <amp-story-grid-layer template="vertical" aspect-ratio="412:618" class="grid-layer i-amphtml-layout-container" i-amphtml-layout="container" style="--aspect-ratio:412/618;">
+                <div class="page-fullbleed-area"><div class="page-safe-area">
+                    <div class="_6120891"><div class="_89d52dd mask" id="el-f00095ab-c147-4f19-9857-72ac678f953f">
+                        <div class="_dc67a5c fill"></div></div></div></div></div>
+            </amp-story-grid-layer>
+            <amp-story-grid-layer template="fill" class="i-amphtml-layout-container" i-amphtml-layout="container">
+                <amp-video autoplay="autoplay" layout="fixed" width="1" height="1" poster="" id="page-$page_id-background-audio" cache="google" class="i-amphtml-layout-fixed i-amphtml-layout-size-defined" style="width:1px;height:1px" i-amphtml-layout="fixed">
+                    <source type="audio/mpeg" src="$audio_url">
+                </amp-video>
+            </amp-story-grid-layer>
+            <amp-story-grid-layer template="vertical" aspect-ratio="412:618" class="grid-layer i-amphtml-layout-container" i-amphtml-layout="container" style="--aspect-ratio:412/618;">
+                <div class="page-fullbleed-area"><div class="page-safe-area">
+                    <div class="_c19e533"><div class="_89d52dd mask" id="el-344ed989-789b-4a01-a124-9ae1d15d67f4">
+                        <div data-leaf-element="true" class="_8aed44c">
+                            <amp-img layout="fill" src="https://media.suvichaar.org/upload/polaris/polarisslide.png" alt="polarisslide.png" disable-inline-width="true" class="i-amphtml-layout-fill i-amphtml-layout-size-defined" i-amphtml-layout="fill"></amp-img>
+                        </div></div></div>
+                    <div class="_3d0c7a9"><div id="anim-1a95e072-cada-435a-afea-082ddd65ff10" class="_75da10d animation-wrapper">
+                        <div id="anim-a938fe3f-03cf-47c5-9a84-da919c4f870b" class="_e559378 animation-wrapper">
+                            <div id="el-2f080472-6c81-40a1-ac00-339cc8981388" class="_5342a26">
+                                <h3 class="_d1a8d0d fill text-wrapper"><span><span class="_14af73e">$paragraph</span></span></h3>
+                            </div></div></div></div>
+                    <div class="_a336742"><div id="anim-f7c5981e-ac77-48d5-9b40-7a987a3e2ab0" class="_75da10d animation-wrapper">
+                        <div id="anim-0c1e94dd-ab91-415c-9372-0aa2e7e61630" class="_09239f8 animation-wrapper">
+                            <div id="el-1a0d583c-c99b-4156-825b-3188408c0551" class="_ee8f788">
+                                <h2 class="_59f9bb8 fill text-wrapper"><span><span class="_14af73e"></span></span></h2>
+                            </div></div></div></div></div></div>
+            </amp-story-grid-layer>
+        </amp-story-page>
+        """)
+
+# Single-pass escaping of narration text for the AMP markup
+_AMP_TEXT_TABLE = str.maketrans({"’": "'", '"': "&quot;"})
+
 # === Streamlit UI ===
 st.title("🧠 Web Story Content Generator")
 
@@ -274,66 +627,98 @@ tab1, tab2, tab3 = st.tabs(["📝 Slide Prompt Generator", "🔊 TTS Audio Gener
 
 with tab1:
     st.title("🧠 Generalized Web Story Prompt Generator")
-    url = st.text_input("Enter a news article URL")
+    batch_mode = st.toggle("🗂️ Batch mode (Azure Batch API — cheaper, results within 24h)")
+    if batch_mode:
+        urls = [u.strip() for u in st.text_area("Enter news article URLs (one per line)").splitlines() if u.strip()]
+    else:
+        url = st.text_input("Enter a news article URL")
     persona = st.selectbox(
         "Choose audience persona:",
         ["genz", "millenial", "working professionals", "creative thinkers", "spiritual explorers"]
     )
 
     if st.button("🚀 Submit and Generate JSON"):
-        if url and persona:
+        if batch_mode and urls and persona:
+            with st.spinner(f"Submitting {len(urls)} articles as a batch job..."):
+                try:
+                    articles, failed = extract_articles(urls)
+                    st.session_state.pop("batch_result", None)
+                    if failed:
+                        st.warning("⚠️ Could not fetch these URLs (skipped):\n" + "\n".join(
+                            f"- {url}: {reason}" for url, reason in failed
+                        ))
+                    job = submit_story_batch(articles, persona) if articles else None
+                    if job is None:
+                        st.error("❌ None of the URLs could be fetched.")
+                    elif job["batch_id"]:
+                        st.success(f"✅ Batch {job['batch_id']} submitted for {len(articles)} articles. Check its status below.")
+                    else:
+                        # Every story was already cached; nothing to wait for
+                        st.session_state["batch_result"] = (job["persona"], *collect_story_batch(job)[1:])
+                except Exception as e:
+                    st.error(f"❌ Error: {str(e)}")
+        elif not batch_mode and url and persona:
             with st.spinner("Analyzing the article and generating news for you..."):
                 try:
                     title, summary, full_text = extract_article(url)
-                    sentiment = get_sentiment(summary or full_text)
-                    result = detect_category_and_subcategory(full_text)
-                    category, subcategory, emotion = result["category"], result["subcategory"], result["emotion"]
-    
-                    output = title_script_generator(category, subcategory, emotion, full_text)
-                    final_output = {
-                        "title": title,
-                        "summary": summary,
-                        "sentiment": sentiment,
-                        "emotion": emotion,
-                        "category": category,
-                        "subcategory": subcategory,
-                        "persona": persona,
-                        "slides": output.get("slides", []),
-                        "storytitle": title.strip()  # ✅ storytitle added here
-                    }
-    
-                    # ✅ Include all metadata and storytitle in the final output JSON
-                    structured_output = {
-                        **restructure_slide_output(final_output),
-                        "storytitle": title.strip(),
-                        "title": title.strip(),
-                        "summary": summary,
-                        "sentiment": sentiment,
-                        "emotion": emotion,
-                        "category": category,
-                        "subcategory": subcategory,
-                        "persona": persona
-                    }
+
+                    # Byte-identical article + same persona: reuse this session's earlier result
+                    run_key = (article_fingerprint(full_text), persona)
+                    story_runs = st.session_state.setdefault("story_runs", {})
+                    structured_output = story_runs.get(run_key)
+                    if structured_output is None:
+                        sentiment, output = analyze_article(summary, full_text)
+                        structured_output = build_structured_output(title, summary, sentiment, persona, output)
+                        # Only remember real stories (intro + generated slides) so a failed run can be retried
+                        if len(output["slides"]) > 1:
+                            story_runs[run_key] = structured_output
     
                     timestamp = int(time.time())
                     filename = f"structured_slides_{timestamp}.json"
     
-                    with open(filename, "w", encoding="utf-8") as f:
-                        json.dump(structured_output, f, indent=2, ensure_ascii=False)
-    
-                    with open(filename, "r", encoding="utf-8") as f:
-                        st.success("✅ Prompt generation complete!! Click below to download:")
-                        st.download_button(
-                            label=f"⬇️ Download JSON ({timestamp})",
-                            data=f.read(),
-                            file_name=filename,
-                            mime="application/json"
-                        )
+                    st.success("✅ Prompt generation complete!! Click below to download:")
+                    st.download_button(
+                        label=f"⬇️ Download JSON ({timestamp})",
+                        data=orjson.dumps(structured_output, option=JSON_DUMP_OPTIONS),
+                        file_name=filename,
+                        mime="application/json"
+                    )
                 except Exception as e:
                     st.error(f"❌ Error: {str(e)}")
         else:
             st.warning("Please enter a valid URL and choose a persona.")
 
+    if batch_mode:
+        pending_batches = get_pending_batches()
+        if pending_batches:
+            batch_id = st.selectbox("Pending batch jobs", sorted(pending_batches))
+            if st.button("🔄 Check batch status"):
+                try:
+                    job = pending_batches[batch_id]
+                    status, results, failed = collect_story_batch(job)
+                    if results is None:
+                        st.info(f"⏳ Batch {batch_id}: {status}")
+                    else:
+                        st.session_state["batch_result"] = (job["persona"], results, failed)
+                except Exception as e:
+                    st.error(f"❌ Error: {str(e)}")
+
+        if "batch_result" in st.session_state:
+            batch_persona, results, failed = st.session_state["batch_result"]
+            if failed:
+                st.warning("⚠️ No story for these URLs (left out of the bundle):\n" + "\n".join(
+                    f"- {url}: {reason}" for url, reason in failed
+                ))
+            if results:
+                timestamp = int(time.time())
+                st.success(f"✅ Batch complete for {len(results)} articles!! Click below to download:")
+                st.download_button(
+                    label=f"⬇️ Download JSON bundle ({timestamp})",
+                    data=build_story_bundle(results, batch_persona, timestamp),
+                    file_name=f"structured_slides_{timestamp}.zip",
+                    mime="application/zip"
+                )
+
 
 
 with tab2:
@@ -342,7 +727,7 @@ with tab2:
     voice_label = st.selectbox("Choose Voice", list(voice_options.values()))
 
     if uploaded_file and voice_label:
-        paragraphs = json.load(uploaded_file)
+        paragraphs = orjson.loads(uploaded_file.getvalue().removeprefix(UTF8_BOM))
         st.success(f"✅ Loaded {len(paragraphs)} paragraphs")
 
         if st.button("🚀 Generate TTS + Upload to S3"):
@@ -352,16 +737,12 @@ with tab2:
                 timestamp = int(time.time())
                 output_filename = f"tts_output_{timestamp}.json"
 
-                with open(output_filename, "w", encoding="utf-8") as f:
-                    json.dump(output, f, indent=2, ensure_ascii=False)
-
-                with open(output_filename, "r", encoding="utf-8") as f:
-                    st.download_button(
-                        label="⬇️ Download Output JSON",
-                        data=f.read(),
-                        file_name=output_filename,
-                        mime="application/json"
-                    )
+                st.download_button(
+                    label="⬇️ Download Output JSON",
+                    data=orjson.dumps(output, option=JSON_DUMP_OPTIONS),
+                    file_name=output_filename,
+                    mime="application/json"
+                )
 
 with tab3:
     #
@@ -371,52 +752,6 @@ with tab3:
     # Fixed path to the AMP HTML template file
     TEMPLATE_PATH = Path("test.html")
     
-    # Function to generate an AMP slide using paragraph and audio URL
-    def generate_slide(paragraph: str, audio_url: str):
-        return f"""
-        <amp-story-page id="c29cbf94-847a-4bb7-a4eb-47d17d8c2d5a" auto-advance-after="page-c29cbf94-847a-4bb7-a4eb-47d17d8c2d5a-background-audio" class="i-amphtml-layout-container" i-amphtml-layout="container">
-            <amp-story-animation layout="nodisplay" trigger="visibility" class="i-amphtml-layout-nodisplay" hidden="hidden" i-amphtml-layout="nodisplay">
-                <script type="application/json">[{{"selector":"#anim-1a95e072-cada-435a-afea-082ddd65ff10","keyframes":{{"opacity":[0,1]}},"delay":0,"duration":600,"easing":"cubic-bezier(0.2, 0.6, 0.0, 1)","fill":"both"}}]</script>
-            </amp-story-animation>
-            <amp-story-animation layout="nodisplay" trigger="visibility" class="i-amphtml-layout-nodisplay" hidden="hidden" i-amphtml-layout="nodisplay">
-                <script type="application/json">[{{"selector":"#anim-a938fe3f-03cf-47c5-9a84-da919c4f870b","keyframes":{{"transform":["translate3d(-115.2381%, 0px, 0)","translate3d(0px, 0px, 0)"]}},"delay":0,"duration":600,"easing":"cubic-bezier(0.2, 0.6, 0.0, 1)","fill":"both"}}]</script>
-            </amp-story-animation>
-            <amp-story-animation layout="nodisplay" trigger="visibility" class="i-amphtml-layout-nodisplay" hidden="hidden" i-amphtml-layout="nodisplay">
-                <script type="application/json">[{{"selector":"#anim-f7c5981e-ac77-48d5-9b40-7a987a3e2ab0","keyframes":{{"opacity":[0,1]}},"delay":0,"duration":600,"easing":"cubic-bezier(0.2, 0.6, 0.0, 1)","fill":"both"}}]</script>
-            </amp-story-animation>
-            <amp-story-animation layout="nodisplay" trigger="visibility" class="i-amphtml-layout-nodisplay" hidden="hidden" i-amphtml-layout="nodisplay">
-                <script type="application/json">[{{"selector":"#anim-0c1e94dd-ab91-415c-9372-0aa2e7e61630","keyframes":{{"transform":["translate3d(-115.55555%, 0px, 0)","translate3d(0px, 0px, 0)"]}},"delay":0,"duration":600,"easing":"cubic-bezier(0.2, 0.6, 0.0, 1)","fill":"both"}}]</script>
-            </amp-story-animation>
-            <amp-story-grid-layer template="vertical" aspect-ratio="412:618" class="grid-layer i-amphtml-layout-container" i-amphtml-layout="container" style="--aspect-ratio:412/618;">
-                <div class="page-fullbleed-area"><div class="page-safe-area">
-                    <div class="_6120891"><div class="_89d52dd mask" id="el-f00095ab-c147-4f19-9857-72ac678f953f">
-                        <div class="_dc67a5c fill"></div></div></div></div></div>
-            </amp-story-grid-layer>
-            <amp-story-grid-layer template="fill" class="i-amphtml-layout-container" i-amphtml-layout="container">
-                <amp-video autoplay="autoplay" layout="fixed" width="1" height="1" poster="" id="page-c29cbf94-847a-4bb7-a4eb-47d17d8c2d5a-background-audio" cache="google" class="i-amphtml-layout-fixed i-amphtml-layout-size-defined" style="width:1px;height:1px" i-amphtml-layout="fixed">
-                    <source type="audio/mpeg" src="{audio_url}">
-                </amp-video>
-            </amp-story-grid-layer>
-            <amp-story-grid-layer template="vertical" aspect-ratio="412:618" class="grid-layer i-amphtml-layout-container" i-amphtml-layout="container" style="--aspect-ratio:412/618;">
-                <div class="page-fullbleed-area"><div class="page-safe-area">
-                    <div class="_c19e533"><div class="_89d52dd mask" id="el-344ed989-789b-4a01-a124-9ae1d15d67f4">
-                        <div data-leaf-element="true" class="_8aed44c">
-                            <amp-img layout="fill" src="https://media.suvichaar.org/upload/polaris/polarisslide.png" alt="polarisslide.png" disable-inline-width="true" class="i-amphtml-layout-fill i-amphtml-layout-size-defined" i-amphtml-layout="fill"></amp-img>
-                        </div></div></div>
-                    <div class="_3d0c7a9"><div id="anim-1a95e072-cada-435a-afea-082ddd65ff10" class="_75da10d animation-wrapper">
-                        <div id="anim-a938fe3f-03cf-47c5-9a84-da919c4f870b" class="_e559378 animation-wrapper">
-                            <div id="el-2f080472-6c81-40a1-ac00-339cc8981388" class="_5342a26">
-                                <h3 class="_d1a8d0d fill text-wrapper"><span><span class="_14af73e">{paragraph}</span></span></h3>
-                            </div></div></div></div>
-                    <div class="_a336742"><div id="anim-f7c5981e-ac77-48d5-9b40-7a987a3e2ab0" class="_75da10d animation-wrapper">
-                        <div id="anim-0c1e94dd-ab91-415c-9372-0aa2e7e61630" class="_09239f8 animation-wrapper">
-                            <div id="el-1a0d583c-c99b-4156-825b-3188408c0551" class="_ee8f788">
-                                <h2 class="_59f9bb8 fill text-wrapper"><span><span class="_14af73e"></span></span></h2>
-                            </div></div></div></div></div></div>
-            </amp-story-grid-layer>
-        </amp-story-page>
-        """
-    
     # Upload output.json file
     output_json_file = st.file_uploader("📦 Upload Output JSON", type=["json"], key="amp_json_upload")
     
@@ -429,24 +764,32 @@ with tab3:
     
         if output_json_file:
             try:
-                output_data = json.load(output_json_file)
+                output_data = orjson.loads(output_json_file.getvalue().removeprefix(UTF8_BOM))
     
                 if "<!--INSERT_SLIDES_HERE-->" not in template_html:
                     st.error("❌ Placeholder <!--INSERT_SLIDES_HERE--> not found in template.html.")
                 else:
-                    all_slides = ""
-                    for key in sorted(output_data.keys(), key=lambda x: int(x.replace("slide", ""))):
-                        slide_num = key.replace("slide", "")
-                        data = output_data[key]
+                    # Stream template head, slides and tail into one buffer instead of
+                    # materializing the joined slides and then a second full-page copy
+                    pre, post = template_html.split("<!--INSERT_SLIDES_HERE-->", 1)
+                    final_html = BytesIO()
+                    final_html.write(pre.encode("utf-8"))
+
+                    # Keys are "slide<N>"; parse N once and sort on it
+                    slides = sorted(((int(key[5:]), data) for key, data in output_data.items()), key=itemgetter(0))
+                    for slide_num, data in slides:
                         para_key = f"s{slide_num}paragraph1"
                         audio_key = f"audio_url{slide_num}"
     
                         if para_key in data and audio_key in data:
-                            paragraph = data[para_key].replace("’", "'").replace('"', '&quot;')
-                            audio_url = data[audio_key]
-                            all_slides += generate_slide(paragraph, audio_url)
-    
-                    final_html = template_html.replace("<!--INSERT_SLIDES_HERE-->", all_slides)
+                            final_html.write(_SLIDE_TMPL.substitute(
+                                page_id=f"slide{slide_num}",
+                                paragraph=data[para_key].translate(_AMP_TEXT_TABLE),
+                                audio_url=data[audio_key]
+                            ).encode("utf-8"))
+
+                    final_html.write(post.encode("utf-8"))
+                    final_html.seek(0)
     
                     timestamp = int(time.time())
                     filename = f"final_output_modified_{timestamp}.html"